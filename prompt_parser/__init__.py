@@ -1,3 +1,3 @@
-from .prompt_parser import Prompt, PromptAttributes
+from .prompt_parser import Prompt, PromptAttributes, PromptAttributesStrict
 
-__all__ = ["Prompt", "PromptAttributes"]
+__all__ = ["Prompt", "PromptAttributes", "PromptAttributesStrict"]
@@ -0,0 +1,34 @@
+"""
+Writes the JSON cache files of all the `.prompt` files in the given directories,
+so that `Prompt.parse_from_file(path, use_cache=True)` does not parse them again.
+
+Usage: python -m prompt_parser.precompile dir/ [dir/ ...]
+"""
+
+import os
+import sys
+from typing import List
+
+from .prompt_parser import Prompt
+
+
+def precompile(directory: str) -> List[str]:
+    """
+    Caches every `.prompt` file under `directory` and returns their paths.
+    """
+    paths = []
+    for root, _, files in os.walk(directory):
+        for name in sorted(files):
+            if name.endswith(".prompt"):
+                path = os.path.join(root, name)
+                Prompt.parse_from_file(path, use_cache=True)
+                paths.append(path)
+    return paths
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        sys.exit(__doc__.strip())
+    for directory in sys.argv[1:]:
+        for path in precompile(directory):
+            print(path)
@@ -1,20 +1,141 @@
-import re
-from typing import Any, Dict, List
+import os
+import threading
+import warnings
+from collections import OrderedDict
+from functools import cache
+from typing import Any, Callable, Dict, Generic, List, Tuple, Type, TypeVar
 from pydantic import BaseModel
-import yaml
-import json
 
+from .utils import parse_flat_yaml, partial_format
 
-def partial_format(template, **kwargs):
-    def replace(match):
-        key = match.group(1)
-        return str(kwargs.get(key, match.group(0)))
+# `yaml` and `json` (or `orjson`) are imported on first use rather than at module
+# load, so `import prompt_parser` does not pay for parsers that may never run.
 
-    pattern = r"\{(\w+)\}"
-    return re.sub(pattern, replace, template)
 
+def _load_yaml(s: str) -> Any:
+    import yaml
 
-class PromptAttributes(BaseModel, extra="allow"):
+    return yaml.load(s, Loader=_yaml_loader())
+
+
+@cache
+def _yaml_loader() -> Any:
+    import yaml
+
+    # Prefer the libyaml-backed loader when PyYAML was built with it
+    if hasattr(yaml, "CSafeLoader"):
+        return yaml.CSafeLoader
+
+    # Told once per process, on the first frontmatter that needs a YAML parser
+    warnings.warn(
+        "PyYAML was built without libyaml, prompt frontmatter is parsed with the "
+        "slower pure-Python loader. Reinstall PyYAML with libyaml to speed it up.",
+        RuntimeWarning,
+        stacklevel=2,
+    )
+    return yaml.SafeLoader
+
+
+@cache
+def _json_loader() -> Callable[[str], Any]:
+    try:
+        import orjson
+
+        return orjson.loads
+    except ImportError:
+        pass
+
+    try:
+        # pydantic-core bundles the `jiter` parser, always available with pydantic v2
+        from pydantic_core import from_json
+
+        return from_json
+    except ImportError:
+        import json
+
+        return json.loads
+
+
+def _load_toml(s: str) -> Any:
+    try:
+        import tomllib
+    except ImportError:
+        # `tomllib` is only in the standard library from Python 3.11
+        import tomli as tomllib  # type: ignore[no-redef]
+
+    return tomllib.loads(s)
+
+
+# Delimiter opening and closing the frontmatter
+_FRONTMATTER_DELIMITER = "---"
+# Delimiter of a TOML frontmatter, only recognized at the start of the prompt
+_TOML_FRONTMATTER_DELIMITER = "+++"
+# Prompts parsed by `Prompt.parse_from_file`, by absolute path and strictness,
+# along with the (mtime, size) of the file they were parsed from and whether its
+# cache file is known to be up to date. Least recently used entries are dropped
+# past `_FILE_CACHE_SIZE`.
+_FILE_CACHE: "OrderedDict[Tuple[str, bool], Tuple[Tuple[int, int], Prompt, bool]]" = (
+    OrderedDict()
+)
+_FILE_CACHE_SIZE = 128
+_FILE_CACHE_LOCK = threading.Lock()
+# Suffix of the JSON files written next to prompt files by
+# `Prompt.parse_from_file(path, use_cache=True)`
+_CACHE_FILE_SUFFIX = ".cache.json"
+
+# Opening and closing delimiters of each known tag
+_TAGS = {tag: (f"<{tag}>", f"</{tag}>") for tag in ("system", "user", "assistant")}
+
+# Indented JSON of the tools written by `Prompt.__str__`, by `repr` of the tools.
+# It is kept outside of the models so that it does not take part in their equality.
+_TOOLS_JSON_CACHE: "OrderedDict[str, str]" = OrderedDict()
+_TOOLS_JSON_CACHE_SIZE = 128
+_TOOLS_JSON_CACHE_LOCK = threading.Lock()
+
+
+def _tools_json(tools: Any) -> str:
+    # The `repr` of the tools is much cheaper to build than their indented JSON, and
+    # unlike `==` it tells apart values that serialize differently, such as 1 and True
+    key = repr(tools)
+    with _TOOLS_JSON_CACHE_LOCK:
+        tools_str = _TOOLS_JSON_CACHE.get(key)
+        if tools_str is not None:
+            _TOOLS_JSON_CACHE.move_to_end(key)
+            return tools_str
+
+    import json
+
+    tools_str = json.dumps(tools, indent=2)
+    with _TOOLS_JSON_CACHE_LOCK:
+        _TOOLS_JSON_CACHE[key] = tools_str
+        if len(_TOOLS_JSON_CACHE) > _TOOLS_JSON_CACHE_SIZE:
+            _TOOLS_JSON_CACHE.popitem(last=False)
+    return tools_str
+
+
+_T = TypeVar("_T")
+
+
+class _Required(Generic[_T]):
+    """
+    Read-only accessor returning the attribute `name`, asserting that it is set
+    """
+
+    __slots__ = ("name", "message")
+
+    def __init__(self, name: str, message: str):
+        self.name = name
+        self.message = message
+
+    def __get__(self, instance: Any, owner: Any = None) -> _T:
+        if instance is None:
+            return self  # type: ignore[return-value]
+        value = getattr(instance, self.name)
+        assert value is not None, self.message
+        return value
+
+
+class PromptAttributes(BaseModel, extra="allow", ignored_types=(_Required,)):
     temperature: float | None = None  # eg 0.5
     top_p: float | None = None  # eg 0.5
     top_k: int | None = None  # eg 50
@@ -24,55 +145,40 @@ class PromptAttributes(BaseModel, extra="allow"):
     max_tokens: int | None = None  # eg 4096
     tools: List[Dict[str, Any]] | None = None
 
-    def __init__(
-        self,
-        **kwargs: Any,
-    ):
-        super().__init__(**kwargs)
-        self.__dict__.update(kwargs)
-
     def __getitem__(self, item: str) -> Any:
+        # Declared fields live in `__dict__` and unknown attributes in `model_extra`,
+        # read them directly before going through the regular attribute lookup
+        if item in self.__dict__:
+            return self.__dict__[item]
+        extra = self.__pydantic_extra__
+        if extra and item in extra:
+            return extra[item]
         return getattr(self, item)
 
-    @property
-    def temperature_forced(self) -> float:
-        assert self.temperature is not None, "Temperature is required"
-        return self.temperature
-
-    @property
-    def top_p_forced(self) -> float:
-        assert self.top_p is not None, "Top P is required"
-        return self.top_p
-
-    @property
-    def top_k_forced(self) -> int:
-        assert self.top_k is not None, "Top K is required"
-        return self.top_k
-
-    @property
-    def provider_forced(self) -> str:
-        assert self.provider is not None, "Provider is required"
-        return self.provider
-
-    @property
-    def model_forced(self) -> str:
-        assert self.model is not None, "Model is required"
-        return self.model
-
-    @property
-    def max_tokens_forced(self) -> int:
-        assert self.max_tokens is not None, "Max tokens is required"
-        return self.max_tokens
-
-    @property
-    def endpoint_forced(self) -> str:
-        assert self.endpoint is not None, "Endpoint is required"
-        return self.endpoint
-
-    @property
-    def tools_forced(self) -> List[Dict[str, Any]]:
-        assert self.tools is not None, "Tools is required"
-        return self.tools
+    def get(self, key: str, default: Any = None) -> Any:
+        """
+        Returns the value of the attribute `key`, or `default` if it is missing or `None`
+        """
+        value = self.__dict__.get(key)
+        if value is None and self.__pydantic_extra__:
+            value = self.__pydantic_extra__.get(key)
+        return default if value is None else value
+
+    temperature_forced = _Required[float]("temperature", "Temperature is required")
+
+    top_p_forced = _Required[float]("top_p", "Top P is required")
+
+    top_k_forced = _Required[int]("top_k", "Top K is required")
+
+    provider_forced = _Required[str]("provider", "Provider is required")
+
+    model_forced = _Required[str]("model", "Model is required")
+
+    max_tokens_forced = _Required[int]("max_tokens", "Max tokens is required")
+
+    endpoint_forced = _Required[str]("endpoint", "Endpoint is required")
+
+    tools_forced = _Required[List[Dict[str, Any]]]("tools", "Tools is required")
 
     def format_tools(
         self,
@@ -85,6 +191,8 @@ class PromptAttributes(BaseModel, extra="allow"):
     ) -> str:
         assert self.tools is not None, "Tools is required"
 
+        import json
+
         tools_str = json.dumps(self.tools)
 
         s: str
@@ -95,12 +203,22 @@ class PromptAttributes(BaseModel, extra="allow"):
             s = tools_str.format(*args, **kwargs)
 
         if store_state:
-            self.tools = json.loads(s)
+            self.tools = _json_loader()(s)
 
         return s
 
 
-class Prompt(BaseModel):
+# pydantic allows freezing a subclass, unlike the dataclasses type checkers model it on
+class PromptAttributesStrict(  # type: ignore[misc]
+    PromptAttributes, extra="forbid", frozen=True
+):
+    """
+    Immutable `PromptAttributes` that rejects unknown attributes, for prompts with a known schema.
+    It skips storing unknown attributes, making instances lighter.
+    """
+
+
+class Prompt(BaseModel, ignored_types=(_Required,)):
     attributes: PromptAttributes
     system: str | None = None
     user: str | None = None
@@ -115,19 +233,7 @@ class Prompt(BaseModel):
         *args: object,
         **kwargs: object,
     ) -> str:
-        assert self.system is not None, "System prompt is required"
-
-        s: str
-        # Format the string partially, without being forced to provide all the parameters
-        if format_partial:
-            s = partial_format(self.system, *args, **kwargs)
-        else:
-            s = self.system.format(*args, **kwargs)
-
-        if store_state:
-            self.system = s
-
-        return s
+        return self.format("system", format_partial, store_state, *args, **kwargs)
 
     def format_user(
         self,
@@ -138,19 +244,7 @@ class Prompt(BaseModel):
         *args: object,
         **kwargs: object,
     ) -> str:
-        assert self.user is not None, "User prompt is required"
-
-        s: str
-        # Format the string partially, without being forced to provide all the parameters
-        if format_partial:
-            s = partial_format(self.user, *args, **kwargs)
-        else:
-            s = self.user.format(*args, **kwargs)
-
-        if store_state:
-            self.user = s
-
-        return s
+        return self.format("user", format_partial, store_state, *args, **kwargs)
 
     def format_assistant(
         self,
@@ -161,24 +255,52 @@ class Prompt(BaseModel):
         *args: object,
         **kwargs: object,
     ) -> str:
-        assert self.assistant is not None, "Assistant prompt is required"
+        return self.format("assistant", format_partial, store_state, *args, **kwargs)
+
+    def format(
+        self,
+        # The prompt to format, one of `system`, `user` or `assistant`.
+        role: str,
+        /,
+        # Whether to partially format the prompt without throwing if some templates are missing, defaults to true.
+        format_partial: bool = True,
+        # Whether to store the formatted variable, defaults to `False`.
+        store_state: bool = False,
+        *args: object,
+        **kwargs: object,
+    ) -> str:
+        """
+        Formats the prompt of the given role, see `format_system`, `format_user` and `format_assistant`
+        """
+        assert role in _TAGS, f"Unknown role {role}"
+        value = getattr(self, role)
+        assert value is not None, f"{role.capitalize()} prompt is required"
 
         s: str
         # Format the string partially, without being forced to provide all the parameters
         if format_partial:
-            s = partial_format(self.assistant, *args, **kwargs)
+            s = partial_format(value, *args, **kwargs)
+        elif "{" not in value and "}" not in value:
+            # Without braces `str.format` would return the string unchanged
+            s = value
         else:
-            s = self.assistant.format(*args, **kwargs)
+            s = value.format(*args, **kwargs)
 
         if store_state:
-            self.assistant = s
+            setattr(self, role, s)
 
         return s
 
     @staticmethod
-    def parse_from_file(path: str) -> "Prompt":
+    def parse_from_file(
+        path: str, strict: bool = False, use_cache: bool = False
+    ) -> "Prompt":
         """
         Parses a prompt file into a Prompt object.
+        With `strict`, the attributes are parsed into a `PromptAttributesStrict`.
+        With `use_cache`, the parsed prompt is also stored in a JSON file next to
+        the prompt file (`<path>.cache.json`), and read back from there by later
+        processes as long as the prompt file does not change.
 
         Example prompt:
 
@@ -205,13 +327,117 @@ class Prompt(BaseModel):
         Hi from assistant
         </assistant>
         """
-        with open(path, "r") as f:
-            return Prompt.parse(f.read())
+        path = os.path.abspath(path)
+        stat = os.stat(path)
+        version = (stat.st_mtime_ns, stat.st_size)
+
+        key = (path, strict)
+        with _FILE_CACHE_LOCK:
+            cached = _FILE_CACHE.get(key)
+            if cached is not None:
+                _FILE_CACHE.move_to_end(key)
+        if cached is None or cached[0] != version:
+            prompt = None
+            if use_cache:
+                prompt = Prompt.__read_cache_file(path, version, strict)
+            if prompt is None:
+                with open(path, "r") as f:
+                    prompt = Prompt.parse(f.read(), strict=strict)
+                if use_cache:
+                    Prompt.__write_cache_file(path, version, prompt)
+            cached = (version, prompt, use_cache)
+            with _FILE_CACHE_LOCK:
+                _FILE_CACHE[key] = cached
+                _FILE_CACHE.move_to_end(key)
+                if len(_FILE_CACHE) > _FILE_CACHE_SIZE:
+                    _FILE_CACHE.popitem(last=False)
+        elif use_cache and not cached[2]:
+            # Parsed earlier without `use_cache`, the cache file may not exist yet
+            Prompt.__write_cache_file(path, version, cached[1])
+            cached = (version, cached[1], True)
+            with _FILE_CACHE_LOCK:
+                if key in _FILE_CACHE:
+                    _FILE_CACHE[key] = cached
+
+        # Return a copy so that changes made by the caller do not leak into the
+        # cache. Re-validating a dump is faster than `model_copy(deep=True)`.
+        prompt = cached[1]
+        attributes = prompt.attributes
+        return Prompt(
+            # Only the set attributes, so that the copy keeps the same `model_fields_set`
+            attributes=type(attributes).model_validate(
+                attributes.model_dump(exclude_unset=True)
+            ),
+            system=prompt.system,
+            user=prompt.user,
+            assistant=prompt.assistant,
+        )
+
+    @staticmethod
+    def __read_cache_file(
+        path: str, version: Tuple[int, int], strict: bool
+    ) -> "Prompt | None":
+        try:
+            with open(path + _CACHE_FILE_SUFFIX, "r") as f:
+                data = _json_loader()(f.read())
+        except (OSError, ValueError):
+            return None
+        # The cache file is stale if the prompt file changed since it was written
+        if not isinstance(data, dict) or data.get("version") != list(version):
+            return None
+        attributes_type = PromptAttributesStrict if strict else PromptAttributes
+        try:
+            return Prompt(
+                attributes=attributes_type(**data["attributes"]),
+                system=data["system"],
+                user=data["user"],
+                assistant=data["assistant"],
+            )
+        except (KeyError, TypeError, ValueError):
+            # A truncated or foreign cache file, the prompt file is parsed instead
+            return None
+
+    @staticmethod
+    def __write_cache_file(path: str, version: Tuple[int, int], prompt: "Prompt"):
+        import json
+
+        data = {
+            "version": list(version),
+            "attributes": prompt.attributes.model_dump(exclude_unset=True),
+            "system": prompt.system,
+            "user": prompt.user,
+            "assistant": prompt.assistant,
+        }
+        try:
+            s = json.dumps(data, allow_nan=False)
+        except (TypeError, ValueError):
+            # Attributes that are not JSON serializable (e.g. YAML dates, NaN)
+            return
+        # JSON turns non-string keys into strings and tuples into lists, only cache
+        # the prompt if it reads back the same
+        if _json_loader()(s) != data:
+            return
+
+        tmp_path = f"{path}{_CACHE_FILE_SUFFIX}.{os.getpid()}.tmp"
+        try:
+            with open(tmp_path, "w") as f:
+                f.write(s)
+            # Replace atomically so that concurrent readers never see a partial file
+            os.replace(tmp_path, path + _CACHE_FILE_SUFFIX)
+        except OSError:
+            # Not writable: the prompt is simply not cached on disk
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
 
     @staticmethod
-    def parse(prompt: str) -> "Prompt":
+    def parse(prompt: str, strict: bool = False) -> "Prompt":
         """
         Parses a prompt string into a Prompt object.
+        With `strict`, the attributes are parsed into a `PromptAttributesStrict`.
+        The frontmatter can also be written in TOML, between `+++` lines at the
+        start of the prompt.
 
         Example prompt:
 
@@ -239,81 +465,102 @@ class Prompt(BaseModel):
         </assistant>
         """
         return Prompt(
-            attributes=Prompt.__parse_frontmatter(prompt),
-            system=Prompt.__parse_tag(tag="system", s=prompt),
-            user=Prompt.__parse_tag(tag="user", s=prompt),
-            assistant=Prompt.__parse_tag(tag="assistant", s=prompt),
+            attributes=Prompt.__parse_frontmatter(
+                prompt, PromptAttributesStrict if strict else PromptAttributes
+            ),
+            **Prompt.__parse_tags(prompt),
         )
 
     @staticmethod
-    def __parse_frontmatter(s: str) -> PromptAttributes:
-        match = re.search(r"---(.*?)---", s, re.DOTALL)
-        if match:
-            frontmatter_raw = match.group(1).strip()
-            frontmatter = yaml.safe_load(frontmatter_raw)
-            return PromptAttributes(**frontmatter)
-        return PromptAttributes()
+    def __parse_frontmatter(
+        s: str, attributes_type: Type[PromptAttributes]
+    ) -> PromptAttributes:
+        stripped = s.lstrip()
+        if stripped.startswith(_TOML_FRONTMATTER_DELIMITER):
+            start = len(_TOML_FRONTMATTER_DELIMITER)
+            end = stripped.find(_TOML_FRONTMATTER_DELIMITER, start)
+            if end >= 0:
+                return attributes_type(**_load_toml(stripped[start:end]))
+
+        # Content between the first two delimiters, like the tags it is located with `str.find`
+        start = s.find(_FRONTMATTER_DELIMITER)
+        end = -1
+        if start >= 0:
+            start += len(_FRONTMATTER_DELIMITER)
+            end = s.find(_FRONTMATTER_DELIMITER, start)
+        if end >= 0:
+            frontmatter_raw = s[start:end].strip()
+            # Most frontmatters are flat scalars, only run the YAML parser when needed
+            frontmatter = parse_flat_yaml(frontmatter_raw)
+            if frontmatter is None:
+                frontmatter = _load_yaml(frontmatter_raw)
+            return attributes_type(**frontmatter)
+        return attributes_type()
 
     @staticmethod
-    def __parse_tag(tag: str, s: str) -> str | None:
+    def __parse_tags(s: str) -> Dict[str, str | None]:
         """
-        Parses the content between <tag> and </tag>
+        Parses the content between <tag> and </tag> for every known tag.
+        Only the first occurrence of each tag is kept.
         """
-        match = re.search(r"<{tag}>(.*?)</{tag}>".format(tag=tag), s, re.DOTALL)
-        if match:
-            content = match.group(1)
-            return content.strip()
-        return None
-
-    @property
-    def system_forced(self) -> str:
-        assert self.system is not None, "System prompt is required"
-        return self.system
-
-    @property
-    def user_forced(self) -> str:
-        assert self.user is not None, "User prompt is required"
-        return self.user
-
-    @property
-    def assistant_forced(self) -> str:
-        assert self.assistant is not None, "Assistant prompt is required"
-        return self.assistant
+        # The delimiters are plain literals, `str.find` locates them much faster than a regex
+        tags: Dict[str, str | None] = {}
+        for tag, (open_tag, close_tag) in _TAGS.items():
+            start = s.find(open_tag)
+            end = -1
+            if start >= 0:
+                start += len(open_tag)
+                end = s.find(close_tag, start)
+            tags[tag] = s[start:end].strip() if end >= 0 else None
+        return tags
+
+    system_forced = _Required[str]("system", "System prompt is required")
+
+    user_forced = _Required[str]("user", "User prompt is required")
+
+    assistant_forced = _Required[str]("assistant", "Assistant prompt is required")
 
     def __str__(self) -> str:
         # Write frontmatter
-        s = "---\n"
+        parts = ["---\n"]
 
-        for attr in self.attributes.__dict__:
+        # Read the declared fields straight from the instance dict, in declaration order
+        values = self.attributes.__dict__
+        for attr in type(self.attributes).model_fields:
             # ignore None attributes
-            attr_value = getattr(self.attributes, attr)
+            attr_value = values.get(attr)
             if attr_value is None:
                 continue
 
             if attr == "tools":
-                s += "tools: "
-                s += json.dumps(self.attributes.tools, indent=2)
-                s += "\n"
+                parts.append("tools: ")
+                parts.append(_tools_json(attr_value))
+                parts.append("\n")
             else:
-                s += f"{attr}: {getattr(self.attributes, attr)}\n"
-        s += "---\n\n"
+                parts.append(f"{attr}: {attr_value}\n")
+
+        # Unknown attributes are kept by pydantic in `model_extra`, not in `__dict__`
+        for attr, attr_value in (self.attributes.model_extra or {}).items():
+            if attr_value is not None:
+                parts.append(f"{attr}: {attr_value}\n")
+        parts.append("---\n\n")
 
         # Write system prompt
         if self.system:
-            s += "<system>\n"
-            s += self.system.strip() + "\n"
-            s += "</system>\n\n"
+            parts.append("<system>\n")
+            parts.append(self.system.strip() + "\n")
+            parts.append("</system>\n\n")
 
         # Write assistant prompt
         if self.assistant:
-            s += "<assistant>\n"
-            s += self.assistant.strip() + "\n"
-            s += "</assistant>\n\n"
+            parts.append("<assistant>\n")
+            parts.append(self.assistant.strip() + "\n")
+            parts.append("</assistant>\n\n")
 
         # Write user prompt
         if self.user:
-            s += "<user>\n"
-            s += self.user.strip() + "\n"
-            s += "</user>\n"
+            parts.append("<user>\n")
+            parts.append(self.user.strip() + "\n")
+            parts.append("</user>\n")
 
-        return s
+        return "".join(parts)
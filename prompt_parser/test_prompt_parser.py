@@ -1,7 +1,15 @@
+import json
+import os
+import tempfile
 import unittest
 from pathlib import Path
 
-from prompt_parser import Prompt, PromptAttributes
+from pydantic import ValidationError
+
+from prompt_parser import Prompt, PromptAttributes, PromptAttributesStrict
+from prompt_parser import prompt_parser as prompt_parser_module
+from prompt_parser.precompile import precompile
+from prompt_parser.utils import parse_flat_yaml
 
 
 class TestPromptParser(unittest.TestCase):
@@ -15,11 +23,17 @@ class TestPromptParser(unittest.TestCase):
         self.assertEqual(prompt.attributes.model, "gpt-4")
         self.assertEqual(prompt.attributes.max_tokens, 4096)
         self.assertEqual(prompt.attributes["unknown"], "blablah")
+        self.assertEqual(prompt.attributes.get("unknown"), "blablah")
+        self.assertEqual(prompt.attributes.get("top_k"), 50)
+        self.assertIsNone(prompt.attributes.get("missing"))
+        self.assertEqual(prompt.attributes.get("missing", 1), 1)
+        self.assertEqual(PromptAttributes().get("temperature", 0.7), 0.7)
         self.assertEqual(prompt.system, "Hi from system")
         self.assertEqual(prompt.user, "Hi from user {custom}")
         self.assertEqual(prompt.assistant, "Hi from assistant")
         formatted_user = prompt.format_user(custom="ciao")
         self.assertEqual(formatted_user, "Hi from user ciao")
+        self.assertEqual(prompt.format("user", custom="ciao"), "Hi from user ciao")
         self.assertEqual(
             prompt.attributes.tools,
             [
@@ -47,6 +61,144 @@ class TestPromptParser(unittest.TestCase):
             ],
         )
 
+    def test_parse_from_file_cache(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = os.path.join(tmp_dir, "task.prompt")
+            Path(path).write_text("<user>\nHi {custom}\n</user>")
+
+            prompt = Prompt.parse_from_file(path)
+            prompt.format_user(store_state=True, custom="ciao")
+            # Changes to a returned prompt must not affect later parses
+            self.assertEqual(Prompt.parse_from_file(path).user, "Hi {custom}")
+
+            # The cache follows changes to the file
+            Path(path).write_text("<user>\nHello again\n</user>")
+            self.assertEqual(Prompt.parse_from_file(path).user, "Hello again")
+
+            # Copies keep the attributes class of the cached prompt
+            prompt = Prompt.parse_from_file(path, strict=True)
+            self.assertIsInstance(prompt.attributes, PromptAttributesStrict)
+
+            # and the attributes that were set in the file
+            Path(path).write_text("---\ntop_k: 5\n---\n<user>Hi</user>")
+            Prompt.parse_from_file(path)
+            prompt = Prompt.parse_from_file(path)
+            self.assertEqual(
+                prompt.attributes.model_dump(exclude_unset=True), {"top_k": 5}
+            )
+
+    def test_parse_from_file_use_cache(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = os.path.join(tmp_dir, "task.prompt")
+            Path(path).write_text("---\ntop_k: 50\nextra: 1\n---\n<user>Hi</user>")
+
+            prompt = Prompt.parse_from_file(path)
+            self.assertFalse(os.path.exists(path + ".cache.json"))
+            self.assertEqual(Prompt.parse_from_file(path, use_cache=True), prompt)
+            self.assertTrue(os.path.exists(path + ".cache.json"))
+
+            # Read back from the cache file, as a new process would
+            prompt_parser_module._FILE_CACHE.clear()
+            self.assertEqual(Prompt.parse_from_file(path, use_cache=True), prompt)
+            with self.assertRaises(ValidationError):
+                Prompt.parse_from_file(path, strict=True, use_cache=True)
+
+            # A stale cache file is ignored
+            Path(path).write_text("<user>Hello again</user>")
+            prompt = Prompt.parse_from_file(path, use_cache=True)
+            self.assertIsNone(prompt.attributes.top_k)
+            self.assertEqual(prompt.user, "Hello again")
+
+            # A truncated cache file is ignored too
+            version = json.loads(Path(path + ".cache.json").read_text())["version"]
+            Path(path + ".cache.json").write_text(json.dumps({"version": version}))
+            prompt_parser_module._FILE_CACHE.clear()
+            prompt = Prompt.parse_from_file(path, use_cache=True)
+            self.assertEqual(prompt.user, "Hello again")
+
+            # Attributes that JSON would not read back the same are not cached
+            os.remove(path + ".cache.json")
+            for frontmatter in ("extra: {1: one}", "extra: .nan"):
+                Path(path).write_text(f"---\n{frontmatter}\n---")
+                Prompt.parse_from_file(path, use_cache=True)
+                self.assertFalse(os.path.exists(path + ".cache.json"))
+
+    def test_precompile(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            paths = [os.path.join(tmp_dir, "a.prompt")]
+            os.mkdir(os.path.join(tmp_dir, "nested"))
+            paths.append(os.path.join(tmp_dir, "nested", "b.prompt"))
+            for path in paths:
+                Path(path).write_text("---\ntop_k: 50\n---\n<user>Hi</user>")
+            Path(tmp_dir, "notes.txt").write_text("not a prompt")
+
+            # Files already parsed in this process get their cache file too
+            Prompt.parse_from_file(paths[0])
+            self.assertEqual(sorted(precompile(tmp_dir)), sorted(paths))
+            for path in paths:
+                self.assertTrue(os.path.exists(path + ".cache.json"))
+            self.assertFalse(
+                os.path.exists(os.path.join(tmp_dir, "notes.txt.cache.json"))
+            )
+
+    def test_parse_tags(self):
+        prompt = Prompt.parse(
+            "<user>\nfirst\n</user>\n<assistant>hi</assistant>\n<user>second</user>"
+        )
+        self.assertIsNone(prompt.system)
+        self.assertEqual(prompt.user, "first")
+        self.assertEqual(prompt.assistant, "hi")
+
+        # An unterminated frontmatter is ignored
+        prompt = Prompt.parse("---\ntop_k: 50\n<user>hi</user>")
+        self.assertIsNone(prompt.attributes.top_k)
+        self.assertEqual(prompt.user, "hi")
+
+        # Each tag is looked up independently, even inside another tag
+        prompt = Prompt.parse("<user>see <system>x</system></user>")
+        self.assertEqual(prompt.system, "x")
+        self.assertEqual(prompt.user, "see <system>x</system>")
+
+    def test_attributes_keep_validated_values(self):
+        attributes = PromptAttributes(top_k="50", unknown="blablah")
+        self.assertEqual(attributes.top_k, 50)
+        self.assertEqual(attributes["unknown"], "blablah")
+        self.assertNotIn("unknown", attributes.__dict__)
+
+        with self.assertRaises(ValidationError):
+            Prompt.parse("---\ntemperature: hot\n---")
+
+    def test_parse_strict(self):
+        prompt = Prompt.parse("---\ntop_k: 50\n---\n<user>hi</user>", strict=True)
+        self.assertIsInstance(prompt.attributes, PromptAttributesStrict)
+        self.assertEqual(prompt.attributes.top_k, 50)
+        with self.assertRaises(ValidationError):
+            prompt.attributes.top_k = 10
+        with self.assertRaises(ValidationError):
+            Prompt.parse("---\nunknown: blablah\n---", strict=True)
+
+    def test_parse_toml_frontmatter(self):
+        prompt = Prompt.parse(
+            '+++\ntemperature = 0.5\nmodel = "gpt-4"\nunknown = "blablah"\n'
+            '[[tools]]\nname = "get_weather"\n+++\n<user>Hi</user>'
+        )
+        self.assertEqual(prompt.attributes.temperature, 0.5)
+        self.assertEqual(prompt.attributes.model, "gpt-4")
+        self.assertEqual(prompt.attributes["unknown"], "blablah")
+        self.assertEqual(prompt.attributes.tools, [{"name": "get_weather"}])
+        self.assertEqual(prompt.user, "Hi")
+
+    def test_parse_flat_yaml(self):
+        self.assertEqual(
+            parse_flat_yaml("temperature: 0.5\ntop_k: 50\n\nmodel: gpt-4"),
+            {"temperature": 0.5, "top_k": 50, "model": "gpt-4"},
+        )
+        # Anything YAML would resolve differently goes to the YAML parser
+        self.assertIsNone(parse_flat_yaml("stream: true"))
+        self.assertIsNone(parse_flat_yaml("on: 1"))
+        self.assertIsNone(parse_flat_yaml("provider: open ai"))
+        self.assertIsNone(parse_flat_yaml("tools: [1, 2]"))
+
     def test_string_representation(self):
         prompt = Prompt(
             attributes=PromptAttributes(
@@ -96,6 +248,56 @@ Hi from user {custom}
         formatted_tools = prompt.attributes.format_tools(function_name="get_weather")
         self.assertEqual(formatted_tools, '[{"name": "get_weather"}]')
 
+        # The serialization must follow changes made to the tools
+        prompt.attributes.tools[0]["name"] = "{other_name}"
+        formatted_tools = prompt.attributes.format_tools(other_name="get_time")
+        self.assertEqual(formatted_tools, '[{"name": "get_time"}]')
+
+        # Including the cached indented serialization written by `str(prompt)`
+        self.assertIn('"name": "{other_name}"', str(prompt))
+        prompt.attributes.tools.append({"name": "get_date"})
+        self.assertIn('"name": "get_date"', str(prompt))
+
+        # Values that compare equal but serialize differently are told apart
+        attributes = PromptAttributes(tools=[{"required": 1}])
+        self.assertEqual(attributes.format_tools(), '[{"required": 1}]')
+        attributes.tools[0]["required"] = True
+        self.assertEqual(attributes.format_tools(), '[{"required": true}]')
+        attributes.tools[0]["required"] = 1.0
+        self.assertEqual(attributes.format_tools(), '[{"required": 1.0}]')
+
+        # Same for the indented serialization written by `str(prompt)`
+        prompt = Prompt(attributes=PromptAttributes(tools=[{"required": 1}]))
+        self.assertIn('"required": 1\n', str(prompt))
+        prompt.attributes.tools[0]["required"] = True
+        self.assertIn('"required": true\n', str(prompt))
+
+    def test_format_tools_keeps_equality(self):
+        attributes = PromptAttributes(tools=[{"a": 1}])
+        attributes.format_tools()
+        self.assertEqual(attributes, PromptAttributes(tools=[{"a": 1}]))
+
+        # Same for the serialization cached by `str(prompt)`
+        example = Path(__file__).with_name("example.prompt").read_text()
+        prompt = Prompt.parse(example)
+        str(prompt)
+        self.assertEqual(prompt, Prompt.parse(example))
+
+    def test_format_tools_store_state(self):
+        prompt = Prompt(
+            attributes=PromptAttributes(tools=[{"name": r"{function_name}"}])
+        )
+        prompt.attributes.format_tools(store_state=True, function_name="get_weather")
+        self.assertEqual(prompt.attributes.tools, [{"name": "get_weather"}])
+
+    def test_format_partial_keeps_unknown_braces(self):
+        prompt = Prompt(
+            attributes=PromptAttributes(),
+            user='Hi {name}, {missing} {"json": {name}} {0} {a.b}',
+        )
+        formatted_user = prompt.format_user(name="ciao")
+        self.assertEqual(formatted_user, 'Hi ciao, {missing} {"json": ciao} {0} {a.b}')
+
 
 if __name__ == "__main__":
     unittest.main()
@@ -0,0 +1,68 @@
+import re
+from functools import lru_cache
+from typing import Any, Dict, FrozenSet, Tuple
+
+_PLACEHOLDER_RE = re.compile(r"\{(\w+)\}")
+# A `key: value` line whose value is an int, a float or a plain word
+_FLAT_YAML_LINE_RE = re.compile(
+    r"([A-Za-z_][A-Za-z0-9_]*):[ ]+"
+    r"(?:(-?(?:0|[1-9][0-9]*))|(-?[0-9]+\.[0-9]+)|([A-Za-z][A-Za-z0-9_./-]*))[ ]*"
+)
+# Plain words that YAML resolves to booleans or null instead of strings
+_YAML_KEYWORDS = frozenset(
+    "yes Yes YES no No NO on On ON off Off OFF "
+    "true True TRUE false False FALSE null Null NULL".split()
+)
+
+
+@lru_cache(maxsize=256)
+def _split_template(template: str) -> Tuple[Tuple[str, ...], FrozenSet[str]]:
+    # Splitting on the placeholder pattern yields literal text at even indexes
+    # and placeholder names at odd ones. Prompts are usually formatted many times,
+    # so the split is cached per template instead of re-scanning it on every call.
+    parts = tuple(_PLACEHOLDER_RE.split(template))
+    return parts, frozenset(parts[1::2])
+
+
+def partial_format(template: str, **kwargs: object) -> str:
+    # Static templates are common, skip the regex pass when there is nothing to replace.
+    # Without kwargs every placeholder would be kept as is, so the template is the result.
+    if not kwargs or "{" not in template:
+        return template
+
+    split, placeholders = _split_template(template)
+    # Same when none of the given values has a placeholder in the template
+    if placeholders.isdisjoint(kwargs):
+        return template
+
+    parts: list = list(split)
+    key: str
+    for i in range(1, len(parts), 2):
+        key = parts[i]
+        parts[i] = str(kwargs[key]) if key in kwargs else "{" + key + "}"
+    return "".join(parts)
+
+
+def parse_flat_yaml(text: str) -> Dict[str, Any] | None:
+    """
+    Parses YAML made only of flat `key: value` lines with int, float or plain word values,
+    the common shape of a prompt frontmatter, without going through a YAML parser.
+    Returns `None` if any line needs the full YAML syntax.
+    """
+    result: Dict[str, Any] = {}
+    for line in text.splitlines():
+        if not line.strip():
+            continue
+        match = _FLAT_YAML_LINE_RE.fullmatch(line)
+        if match is None:
+            return None
+        key, int_value, float_value, str_value = match.groups()
+        if key in _YAML_KEYWORDS or str_value in _YAML_KEYWORDS:
+            return None
+        if int_value is not None:
+            result[key] = int(int_value)
+        elif float_value is not None:
+            result[key] = float(float_value)
+        else:
+            result[key] = str_value
+    return result
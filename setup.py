@@ -1,3 +1,5 @@
+import os
+
 from setuptools import setup, find_packages
 
 with open("requirements.txt") as f:
@@ -6,6 +8,28 @@ with open("requirements.txt") as f:
 with open("VERSION") as version_file:
     version = version_file.read().strip()
 
+# Opt-in native builds of the pure helpers in `prompt_parser/utils.py`:
+# `PROMPT_PARSER_CYTHON=1 pip install .` compiles them with Cython and
+# `PROMPT_PARSER_MYPYC=1 pip install .` with mypyc. The pydantic models are never
+# compiled, and the plain Python sources are used whenever no extension is built.
+COMPILED_MODULES = ["prompt_parser/utils.py"]
+
+ext_modules = []
+if os.environ.get("PROMPT_PARSER_CYTHON"):
+    from Cython.Build import cythonize
+
+    ext_modules = cythonize(
+        COMPILED_MODULES,
+        compiler_directives={"language_level": "3"},
+    )
+elif os.environ.get("PROMPT_PARSER_MYPYC"):
+    from mypyc.build import mypycify
+
+    # mypyc type-checks the whole package, PyYAML ships without type stubs
+    ext_modules = mypycify(
+        ["--ignore-missing-imports", *COMPILED_MODULES], opt_level="3"
+    )
+
 setup(
     name="prompt_parser",
     version=version,
@@ -22,7 +46,12 @@ setup(
         "Operating System :: OS Independent",
     ],
     python_requires=">=3.6",
+    ext_modules=ext_modules,
     install_requires=requirements,
+    extras_require={
+        "speedups": ["orjson"],
+        "toml": ['tomli; python_version < "3.11"'],
+    },
     project_urls={
         "GitHub": "https://github.com/nank1ro/prompt-parser",
         "Changelog": "https://github.com/nank1ro/prompt-parser/blob/main/CHANGELOG.md",